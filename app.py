@@ -1,10 +1,11 @@
 ﻿import streamlit as st
 import logging
+from typing import Dict, Mapping
 from services.llm_service import LLMService
 from services.chat_manager import ChatManager
 from components.chat_sidebar import render_chat_sidebar, get_or_create_conversation
 from components.model_selector import render_model_selector
-from utils.helpers import sanitize_input, format_response_time
+from utils.helpers import sanitize_input, format_response_time, iterate_async, run_async
 from config import Config
 
 # Configure logging
@@ -19,19 +20,29 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def get_llm_service() -> LLMService:
+    """Return the process-wide LLMService so sessions share one HTTP connection pool."""
+    return LLMService()
+
+@st.cache_resource
+def get_chat_manager() -> ChatManager:
+    """Return the process-wide ChatManager so sessions share one database connection."""
+    return ChatManager()
+
 def initialize_session_state():
     """Initialize Streamlit session state variables."""
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "llm_service" not in st.session_state:
         try:
-            st.session_state.llm_service = LLMService()
+            st.session_state.llm_service = get_llm_service()
         except ValueError as e:
             st.error(f"Configuration Error: {e}")
             st.info("Please check your .env file and ensure all required API keys are set.")
             st.stop()
     if "chat_manager" not in st.session_state:
-        st.session_state.chat_manager = ChatManager()
+        st.session_state.chat_manager = get_chat_manager()
     
     # Initialize model settings with defaults
     if "selected_model" not in st.session_state:
@@ -42,28 +53,89 @@ def initialize_session_state():
         st.session_state.max_tokens = 1000
     if "system_prompt" not in st.session_state:
         st.session_state.system_prompt = None
+    if "compare_models" not in st.session_state:
+        st.session_state.compare_models = []
+
+def format_message_details(metadata: Dict) -> str:
+    """Render response metadata as a one-row markdown table."""
+    cost = metadata.get("estimated_cost", 0)
+    cost_display = f"${cost:.4f}" if isinstance(cost, (int, float)) and cost > 0 else "N/A"
+    return (
+        "| Response Time | Model | Tokens Used | Est. Cost |\n"
+        "|---|---|---|---|\n"
+        f"| {metadata.get('response_time', 'N/A')} | {metadata.get('model_used', 'N/A')} "
+        f"| {metadata.get('tokens_used', 'N/A')} | {cost_display} |"
+    )
 
 def display_messages():
-    """Display chat message history with enhanced metadata."""
+    """
+    Display chat message history with enhanced metadata.
+    
+    Every rerun redraws the whole history, so each message is kept to as few
+    elements as possible: its content plus one table inside the expander,
+    formatted once and memoized on the message.
+    """
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
             if "metadata" in message and message["metadata"]:
+                if "_details" not in message:
+                    message["_details"] = format_message_details(message["metadata"])
                 with st.expander(" Response Details", expanded=False):
-                    metadata = message["metadata"]
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric(" Response Time", metadata.get("response_time", "N/A"))
-                    with col2:
-                        st.metric(" Model", metadata.get("model_used", "N/A"))
-                    with col3:
-                        st.metric(" Tokens Used", metadata.get("tokens_used", "N/A"))
-                    with col4:
-                        cost = metadata.get("estimated_cost", 0)
-                        if isinstance(cost, (int, float)) and cost > 0:
-                            st.metric(" Est. Cost", f"")
-                        else:
-                            st.metric(" Est. Cost", "N/A")
+                    st.markdown(message["_details"])
+
+def render_model_comparison(conversation_id: str, prompt: str, compare_models: list,
+                            models: Mapping[str, Dict], temperature: float, max_tokens: int,
+                            system_prompt: str):
+    """Query several models concurrently and render their answers side by side."""
+    llm_service = st.session_state.llm_service
+    
+    with st.chat_message("assistant"):
+        with st.spinner(f" Asking {len(compare_models)} models..."):
+            try:
+                results = run_async(llm_service.asend_message_multi(
+                    prompt,
+                    compare_models,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    system_prompt=system_prompt
+                ))
+            except Exception as e:
+                logger.error(f"Unexpected error in model comparison: {e}")
+                st.error(" An unexpected error occurred. Please try again.")
+                return
+        
+        columns = st.columns(len(results))
+        for column, (model, result) in zip(columns, results.items()):
+            with column:
+                st.markdown(f"**{models[model]['name']}**")
+                if result["success"]:
+                    response = result["response"]
+                    metadata = {
+                        "response_time": format_response_time(result["response_time"]),
+                        "model_used": result.get("model_used", "Unknown"),
+                        "tokens_used": result.get("tokens_used", "Unknown"),
+                        "estimated_cost": result.get("estimated_cost", 0),
+                        "temperature": temperature,
+                        "max_tokens": max_tokens,
+                        "system_prompt_used": bool(system_prompt)
+                    }
+                    st.markdown(response)
+                    st.caption(f" Responded in {metadata['response_time']}")
+                else:
+                    response = f"I apologize, but I encountered an error: {result['error']}"
+                    metadata = None
+                    st.error(f" Error: {result['error']}")
+                
+                # Keep each model's answer in the conversation history
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": response,
+                    "metadata": metadata
+                })
+                st.session_state.chat_manager.add_message(
+                    conversation_id, "assistant", response, metadata
+                )
 
 def main():
     """Enhanced main application function with multi-model support."""
@@ -72,26 +144,26 @@ def main():
     
     # Initialize session state
     initialize_session_state()
+    models = st.session_state.llm_service.get_available_models()
     
     # Render chat sidebar
     render_chat_sidebar(st.session_state.chat_manager)
     
     # Render model selector and get current settings
-    selected_model, temperature, max_tokens, system_prompt = render_model_selector(st.session_state.llm_service)
+    selected_model, temperature, max_tokens, system_prompt, compare_models = render_model_selector(st.session_state.llm_service)
+    model_name = models[selected_model]["name"]
     
     # Get or create current conversation
     conversation_id = get_or_create_conversation(st.session_state.chat_manager)
     
     # Display current conversation and model info
     if conversation_id:
-        conversation = st.session_state.chat_manager.load_conversation(conversation_id)
+        conversation = st.session_state.chat_manager.get_conversation_summary(conversation_id)
         if conversation:
             col1, col2 = st.columns([2, 1])
             with col1:
                 st.caption(f" **{conversation['title']}** | Messages: {len(st.session_state.messages)}")
             with col2:
-                models = st.session_state.llm_service.get_available_models()
-                model_name = models[selected_model]["name"]
                 st.caption(f" Using: **{model_name}**")
     
     # Display existing messages
@@ -99,6 +171,11 @@ def main():
     
     # Chat input
     if prompt := st.chat_input("What would you like to know?"):
+        # Reject oversized input before spending time sanitizing it
+        if len(prompt) > Config.MAX_MESSAGE_LENGTH:
+            st.error(f"Message too long. Maximum {Config.MAX_MESSAGE_LENGTH} characters allowed.")
+            return
+        
         # Sanitize input
         sanitized_prompt = sanitize_input(prompt)
         
@@ -107,9 +184,13 @@ def main():
             return
         
         # Show cost estimation before sending
-        estimated_cost = st.session_state.llm_service.estimate_cost(sanitized_prompt, selected_model)
+        prompt_tokens = st.session_state.llm_service.count_tokens(sanitized_prompt, selected_model)
+        estimated_cost = st.session_state.llm_service.estimate_cost(
+            sanitized_prompt, selected_model, prompt_tokens=prompt_tokens
+        )
         if estimated_cost > 0:
-            st.info(f" Estimated cost: ")
+            token_info = f" ({prompt_tokens} prompt tokens)" if prompt_tokens is not None else ""
+            st.info(f" Estimated cost: ${estimated_cost:.4f}{token_info}")
         
         # Add user message to chat history
         user_message = {"role": "user", "content": sanitized_prompt}
@@ -124,71 +205,80 @@ def main():
         with st.chat_message("user"):
             st.markdown(sanitized_prompt)
         
+        # Fan out to every selected model when comparing
+        if len(compare_models) > 1:
+            render_model_comparison(
+                conversation_id, sanitized_prompt, compare_models, models,
+                temperature, max_tokens, system_prompt
+            )
+            return
+        
         # Generate assistant response with selected model and settings
         with st.chat_message("assistant"):
-            models = st.session_state.llm_service.get_available_models()
-            with st.spinner(f" {models[selected_model]['name']} is thinking..."):
-                try:
-                    result = st.session_state.llm_service.send_message(
+            try:
+                result = {}
+                st.write_stream(iterate_async(
+                    st.session_state.llm_service.asend_message(
                         sanitized_prompt,
                         model=selected_model,
                         temperature=temperature,
                         max_tokens=max_tokens,
-                        system_prompt=system_prompt
+                        system_prompt=system_prompt,
+                        result=result
+                    )
+                ))
+                
+                if result["success"]:
+                    response = result["response"]
+                    
+                    # Create enhanced response metadata
+                    metadata = {
+                        "response_time": format_response_time(result["response_time"]),
+                        "model_used": result.get("model_used", "Unknown"),
+                        "tokens_used": result.get("tokens_used", "Unknown"),
+                        "estimated_cost": result.get("estimated_cost", 0),
+                        "temperature": temperature,
+                        "max_tokens": max_tokens,
+                        "system_prompt_used": bool(system_prompt)
+                    }
+                    
+                    # Add assistant message to chat history
+                    assistant_message = {
+                        "role": "assistant",
+                        "content": response,
+                        "metadata": metadata
+                    }
+                    st.session_state.messages.append(assistant_message)
+                    
+                    # Save assistant message to conversation
+                    st.session_state.chat_manager.add_message(
+                        conversation_id, "assistant", response, metadata
+                    )
+                    
+                    # Show enhanced success message
+                    cost_info = f" | Cost: " if metadata['estimated_cost'] > 0 else ""
+                    st.success(f" {model_name} responded in {metadata['response_time']}{cost_info}")
+                    
+                else:
+                    error_msg = result["error"]
+                    st.error(f" Error: {error_msg}")
+                    
+                    # Add error message to chat history
+                    error_message = {
+                        "role": "assistant",
+                        "content": f"I apologize, but I encountered an error: {error_msg}",
+                        "metadata": None
+                    }
+                    st.session_state.messages.append(error_message)
+                    
+                    # Save error to conversation
+                    st.session_state.chat_manager.add_message(
+                        conversation_id, "assistant", error_message["content"]
                     )
                     
-                    if result["success"]:
-                        response = result["response"]
-                        st.markdown(response)
-                        
-                        # Create enhanced response metadata
-                        metadata = {
-                            "response_time": format_response_time(result["response_time"]),
-                            "model_used": result.get("model_used", "Unknown"),
-                            "tokens_used": result.get("tokens_used", "Unknown"),
-                            "estimated_cost": result.get("estimated_cost", 0),
-                            "temperature": temperature,
-                            "max_tokens": max_tokens,
-                            "system_prompt_used": bool(system_prompt)
-                        }
-                        
-                        # Add assistant message to chat history
-                        assistant_message = {
-                            "role": "assistant",
-                            "content": response,
-                            "metadata": metadata
-                        }
-                        st.session_state.messages.append(assistant_message)
-                        
-                        # Save assistant message to conversation
-                        st.session_state.chat_manager.add_message(
-                            conversation_id, "assistant", response, metadata
-                        )
-                        
-                        # Show enhanced success message
-                        cost_info = f" | Cost: " if metadata['estimated_cost'] > 0 else ""
-                        st.success(f" {models[selected_model]['name']} responded in {metadata['response_time']}{cost_info}")
-                        
-                    else:
-                        error_msg = result["error"]
-                        st.error(f" Error: {error_msg}")
-                        
-                        # Add error message to chat history
-                        error_message = {
-                            "role": "assistant",
-                            "content": f"I apologize, but I encountered an error: {error_msg}",
-                            "metadata": None
-                        }
-                        st.session_state.messages.append(error_message)
-                        
-                        # Save error to conversation
-                        st.session_state.chat_manager.add_message(
-                            conversation_id, "assistant", error_message["content"]
-                        )
-                        
-                except Exception as e:
-                    logger.error(f"Unexpected error in main chat loop: {e}")
-                    st.error(" An unexpected error occurred. Please try again.")
+            except Exception as e:
+                logger.error(f"Unexpected error in main chat loop: {e}")
+                st.error(" An unexpected error occurred. Please try again.")
 
 if __name__ == "__main__":
-    main()
+    main()
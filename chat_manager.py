@@ -1,15 +1,147 @@
-﻿import json
-import os
+﻿import orjson
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import ClassVar, List, Dict, Optional, Set
 from pathlib import Path
 
+DB_FILENAME = "chat.db"
+OPEN_CONVERSATIONS_CACHE_SIZE = 10
+
+# Timestamps are integer milliseconds since the epoch. message_count is
+# denormalized so listing conversations never touches the messages table.
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL,
+        message_count INTEGER NOT NULL DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at)",
+    """CREATE TABLE IF NOT EXISTS messages (
+        conv_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        metadata_json TEXT,
+        PRIMARY KEY (conv_id, idx)
+    )""",
+)
+
+def _now_ms() -> int:
+    """Current time as integer milliseconds since the epoch."""
+    return time.time_ns() // 1_000_000
+
+def _to_epoch_ms(value) -> int:
+    """Convert a legacy JSON timestamp (ISO-8601 string or epoch ms) to epoch ms."""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+
 class ChatManager:
     """Manages chat conversations with persistence."""
     
+    # Storage directories already created and migrated in this process
+    _initialized_dirs: ClassVar[Set[str]] = set()
+    
     def __init__(self, storage_dir: str = "data/chat_history"):
         self.storage_dir = Path(storage_dir)
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.storage_dir / DB_FILENAME
+        first_use = str(self.storage_dir) not in ChatManager._initialized_dirs
+        is_new = False
+        if first_use:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+            is_new = not self.db_path.exists()
+        
+        # Streamlit runs each rerun on a new thread, so the connection is
+        # shared across threads and serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        
+        # Next message index for recently used conversations (LRU), so
+        # appending a message never has to look at earlier rows
+        self._open_convs: "OrderedDict[str, int]" = OrderedDict()
+        
+        if first_use:
+            # WAL mode and the schema persist in the database file, so they
+            # only need setting up once per process
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._init_schema()
+            if is_new:
+                self._import_json_conversations()
+            ChatManager._initialized_dirs.add(str(self.storage_dir))
+    
+    def _init_schema(self):
+        """Create the tables and index if they don't exist yet."""
+        with self._lock, self._conn:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+    
+    def _import_json_conversations(self):
+        """Import conversations saved as JSON files by earlier versions."""
+        for file_path in self.storage_dir.glob("*.json"):
+            try:
+                with open(file_path, 'rb') as f:
+                    data = orjson.loads(f.read())
+                data["created_at"] = _to_epoch_ms(data["created_at"])
+                data["updated_at"] = _to_epoch_ms(data["updated_at"])
+                for message in data.get("messages", []):
+                    if "timestamp" in message:
+                        message["timestamp"] = _to_epoch_ms(message["timestamp"])
+                with self._lock, self._conn:
+                    self._write_conversation(data)
+            except Exception:
+                continue
+    
+    def _dumps(self, data: Dict) -> str:
+        """Serialize message metadata compactly as UTF-8 JSON."""
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def _remember_next_idx(self, conversation_id: str, next_idx: int):
+        """Record the next message index for a conversation. Caller holds the lock."""
+        self._open_convs[conversation_id] = next_idx
+        self._open_convs.move_to_end(conversation_id)
+        if len(self._open_convs) > OPEN_CONVERSATIONS_CACHE_SIZE:
+            self._open_convs.popitem(last=False)
+    
+    def _write_conversation(self, conversation_data: Dict):
+        """Replace a conversation header and all of its messages. Caller holds the lock."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversations (id, title, created_at, updated_at, message_count) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (conversation_data["id"], conversation_data["title"],
+             conversation_data["created_at"], conversation_data["updated_at"],
+             len(conversation_data.get("messages", [])))
+        )
+        self._conn.execute("DELETE FROM messages WHERE conv_id = ?", (conversation_data["id"],))
+        self._conn.executemany(
+            "INSERT INTO messages (conv_id, idx, role, content, ts, metadata_json) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (conversation_data["id"], idx, message["role"], message["content"],
+                 message.get("timestamp", conversation_data["updated_at"]),
+                 self._dumps(message.get("metadata") or {}))
+                for idx, message in enumerate(conversation_data.get("messages", []))
+            ]
+        )
+        self._remember_next_idx(conversation_data["id"], len(conversation_data.get("messages", [])))
+    
+    def _insert_message(self, conversation_id: str, idx: int, row: tuple):
+        """Insert one message row at a given index. Caller holds the lock."""
+        self._conn.execute(
+            "INSERT INTO messages (conv_id, idx, role, content, ts, metadata_json) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (conversation_id, idx) + row
+        )
     
     def create_conversation(self, title: str = None) -> str:
         """Create a new conversation."""
@@ -20,8 +152,8 @@ class ChatManager:
         conversation_data = {
             "id": conversation_id,
             "title": title,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
+            "created_at": _now_ms(),
+            "updated_at": _now_ms(),
             "messages": []
         }
         
@@ -29,71 +161,101 @@ class ChatManager:
         return conversation_id
     
     def save_conversation(self, conversation_id: str, conversation_data: Dict):
-        """Save conversation to file."""
-        file_path = self.storage_dir / f"{conversation_id}.json"
-        conversation_data["updated_at"] = datetime.now().isoformat()
+        """Save a full conversation, replacing any stored messages."""
+        conversation_data["updated_at"] = _now_ms()
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(conversation_data, f, indent=2, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._write_conversation({**conversation_data, "id": conversation_id})
     
     def load_conversation(self, conversation_id: str) -> Optional[Dict]:
-        """Load conversation from file."""
-        file_path = self.storage_dir / f"{conversation_id}.json"
-        if not file_path.exists():
-            return None
-        
+        """Load a conversation with all of its messages."""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
+            with self._lock:
+                header = self._conn.execute(
+                    "SELECT id, title, created_at, updated_at FROM conversations WHERE id = ?",
+                    (conversation_id,)
+                ).fetchone()
+                if header is None:
+                    return None
+                rows = self._conn.execute(
+                    "SELECT role, content, ts, metadata_json FROM messages "
+                    "WHERE conv_id = ? ORDER BY idx",
+                    (conversation_id,)
+                ).fetchall()
+                self._remember_next_idx(conversation_id, len(rows))
+        except sqlite3.Error:
             return None
+        
+        conversation = dict(header)
+        conversation["messages"] = [
+            {
+                "role": row["role"],
+                "content": row["content"],
+                "timestamp": row["ts"],
+                "metadata": orjson.loads(row["metadata_json"]) if row["metadata_json"] else {}
+            }
+            for row in rows
+        ]
+        return conversation
+    
+    def get_conversation_summary(self, conversation_id: str) -> Optional[Dict]:
+        """Get a conversation's metadata without loading its messages."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, title, created_at, updated_at, message_count "
+                "FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return dict(row) if row else None
     
     def get_all_conversations(self) -> List[Dict]:
-        """Get list of all conversations."""
-        conversations = []
-        
-        for file_path in self.storage_dir.glob("*.json"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    conversations.append({
-                        "id": data["id"],
-                        "title": data["title"],
-                        "created_at": data["created_at"],
-                        "updated_at": data["updated_at"],
-                        "message_count": len(data.get("messages", []))
-                    })
-            except Exception:
-                continue
-        
-        # Sort by updated_at (most recent first)
-        conversations.sort(key=lambda x: x["updated_at"], reverse=True)
-        return conversations
+        """Get metadata for all conversations, most recently updated first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, title, created_at, updated_at, message_count "
+                "FROM conversations ORDER BY updated_at DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
     
     def add_message(self, conversation_id: str, role: str, content: str, metadata: Dict = None):
-        """Add a message to a conversation."""
-        conversation = self.load_conversation(conversation_id)
-        if not conversation:
-            return False
+        """Append a message to a conversation without rewriting earlier messages."""
+        timestamp = _now_ms()
         
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat(),
-            "metadata": metadata or {}
-        }
-        
-        conversation["messages"].append(message)
-        self.save_conversation(conversation_id, conversation)
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE conversations SET updated_at = ?, message_count = message_count + 1 "
+                "WHERE id = ?",
+                (timestamp, conversation_id)
+            )
+            if updated.rowcount == 0:
+                self._open_convs.pop(conversation_id, None)
+                return False
+            
+            row = (role, content, timestamp, self._dumps(metadata or {}))
+            next_idx = self._open_convs.get(conversation_id)
+            try:
+                if next_idx is None:
+                    raise KeyError(conversation_id)
+                self._insert_message(conversation_id, next_idx, row)
+            except (KeyError, sqlite3.IntegrityError):
+                # Not cached, or another writer appended since we cached it
+                next_idx = self._conn.execute(
+                    "SELECT COALESCE(MAX(idx) + 1, 0) FROM messages WHERE conv_id = ?",
+                    (conversation_id,)
+                ).fetchone()[0]
+                self._insert_message(conversation_id, next_idx, row)
+            self._remember_next_idx(conversation_id, next_idx + 1)
         return True
     
     def delete_conversation(self, conversation_id: str) -> bool:
         """Delete a conversation."""
-        file_path = self.storage_dir / f"{conversation_id}.json"
         try:
-            if file_path.exists():
-                file_path.unlink()
-                return True
-        except Exception:
-            pass
-        return False
+            with self._lock, self._conn:
+                self._open_convs.pop(conversation_id, None)
+                self._conn.execute("DELETE FROM messages WHERE conv_id = ?", (conversation_id,))
+                deleted = self._conn.execute(
+                    "DELETE FROM conversations WHERE id = ?", (conversation_id,)
+                )
+            return deleted.rowcount > 0
+        except sqlite3.Error:
+            return False
@@ -1,5 +1,28 @@
 ﻿import streamlit as st
 from services.chat_manager import ChatManager
+from utils.helpers import format_timestamp
+
+def _new_chat(chat_manager: ChatManager):
+    """Start a fresh conversation (button callback)."""
+    st.session_state.current_conversation_id = chat_manager.create_conversation()
+    st.session_state.messages = []
+
+def _open_conversation(chat_manager: ChatManager, conversation_id: str):
+    """Switch to a saved conversation (button callback)."""
+    conversation_data = chat_manager.load_conversation(conversation_id)
+    if conversation_data:
+        st.session_state.current_conversation_id = conversation_id
+        st.session_state.messages = conversation_data.get('messages', [])
+        st.session_state.conversation_switched = True
+
+def _delete_conversation(chat_manager: ChatManager):
+    """Delete the conversation picked in the delete popover (button callback)."""
+    target_id = st.session_state.get('delete_target')
+    if target_id and chat_manager.delete_conversation(target_id):
+        if st.session_state.get('current_conversation_id') == target_id:
+            st.session_state.current_conversation_id = None
+            st.session_state.messages = []
+            st.session_state.conversation_switched = True
 
 def render_chat_sidebar(chat_manager: ChatManager):
     """Render the chat sidebar with conversation management."""
@@ -8,50 +31,67 @@ def render_chat_sidebar(chat_manager: ChatManager):
         st.header(" Conversations")
         
         # New conversation button
-        if st.button(" New Chat", use_container_width=True, type="primary"):
-            new_id = chat_manager.create_conversation()
-            st.session_state.current_conversation_id = new_id
-            st.session_state.messages = []
-            st.rerun()
-        
-        # Get all conversations
-        conversations = chat_manager.get_all_conversations()
+        st.button(
+            " New Chat",
+            use_container_width=True,
+            type="primary",
+            on_click=_new_chat,
+            args=(chat_manager,)
+        )
         
-        # Display conversations
-        if conversations:
-            st.subheader("Recent Chats")
-            
-            for conv in conversations[:10]:  # Show last 10
-                # Create container for each conversation
-                with st.container():
-                    col1, col2 = st.columns([4, 1])
-                    
-                    with col1:
-                        # Conversation button
-                        title_display = conv['title'][:25] + "..." if len(conv['title']) > 25 else conv['title']
-                        if st.button(
-                            title_display,
-                            key=f"conv_{conv['id']}",
-                            help=f"Messages: {conv['message_count']} | {conv['updated_at'][:10]}",
-                            use_container_width=True
-                        ):
-                            # Load selected conversation
-                            conversation_data = chat_manager.load_conversation(conv['id'])
-                            if conversation_data:
-                                st.session_state.current_conversation_id = conv['id']
-                                st.session_state.messages = conversation_data.get('messages', [])
-                                st.rerun()
-                    
-                    with col2:
-                        # Delete button
-                        if st.button("", key=f"del_{conv['id']}", help="Delete"):
-                            if chat_manager.delete_conversation(conv['id']):
-                                if st.session_state.get('current_conversation_id') == conv['id']:
-                                    st.session_state.current_conversation_id = None
-                                    st.session_state.messages = []
-                                st.rerun()
-        else:
-            st.info("No conversations yet. Start a new chat!")
+        render_conversation_list(chat_manager)
+
+@st.fragment
+def render_conversation_list(chat_manager: ChatManager):
+    """
+    Render recent conversations and the delete control.
+    
+    Runs as a fragment, so interacting with it reruns only the list unless
+    the main chat area has to change too.
+    """
+    # Callbacks can't rerun the app, so escalate once here when a callback
+    # changed the conversation shown in the main chat area
+    if st.session_state.pop('conversation_switched', False):
+        st.rerun()
+    
+    # Get all conversations
+    conversations = chat_manager.get_all_conversations()
+    
+    if not conversations:
+        st.info("No conversations yet. Start a new chat!")
+        return
+    
+    st.subheader("Recent Chats")
+    recent = conversations[:10]  # Show last 10
+    
+    for conv in recent:
+        # Conversation button
+        title_display = conv['title'][:25] + "..." if len(conv['title']) > 25 else conv['title']
+        st.button(
+            title_display,
+            key=f"conv_{conv['id']}",
+            help=f"Messages: {conv['message_count']} | {format_timestamp(conv['updated_at'], '%Y-%m-%d')}",
+            use_container_width=True,
+            on_click=_open_conversation,
+            args=(chat_manager, conv['id'])
+        )
+    
+    # One shared delete control instead of a delete button per row
+    titles = {conv['id']: conv['title'] for conv in recent}
+    with st.popover(" Delete a chat", use_container_width=True):
+        st.selectbox(
+            "Conversation",
+            list(titles),
+            format_func=titles.get,
+            key="delete_target"
+        )
+        st.button(
+            "Delete",
+            key="delete_confirm",
+            type="primary",
+            on_click=_delete_conversation,
+            args=(chat_manager,)
+        )
 
 def get_or_create_conversation(chat_manager: ChatManager) -> str:
     """Get current conversation ID or create a new one."""
@@ -60,4 +100,4 @@ def get_or_create_conversation(chat_manager: ChatManager) -> str:
         st.session_state.current_conversation_id = conversation_id
         return conversation_id
     
-    return st.session_state.current_conversation_id
+    return st.session_state.current_conversation_id
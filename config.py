@@ -16,6 +16,9 @@ class Config:
     MAX_MESSAGE_LENGTH: int = 4000
     API_TIMEOUT: int = 30
     MAX_RETRIES: int = 3
+    MAX_CONCURRENT_REQUESTS: int = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+    HTTP_MAX_CONNECTIONS: int = 64
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 32
     
     @classmethod
     def validate_config(cls) -> bool:
@@ -30,4 +33,4 @@ class Config:
         missing = []
         if not cls.OPENAI_API_KEY:
             missing.append("OPENAI_API_KEY")
-        return missing
+        return missing
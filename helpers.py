@@ -1,5 +1,15 @@
-﻿import re
-import html
+﻿import html
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+# Characters removed from user input, as a str.translate table built once
+_DANGEROUS_CHARS_TABLE = str.maketrans("", "", "<>\"'")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
 
 def sanitize_input(text: str) -> str:
     """
@@ -18,7 +28,7 @@ def sanitize_input(text: str) -> str:
     text = html.escape(text)
     
     # Remove potentially dangerous characters
-    text = re.sub(r'[<>"\']', '', text)
+    text = text.translate(_DANGEROUS_CHARS_TABLE)
     
     # Limit length
     if len(text) > 4000:
@@ -31,4 +41,51 @@ def format_response_time(response_time: float) -> str:
     if response_time < 1:
         return f"{response_time * 1000:.0f}ms"
     else:
-        return f"{response_time:.2f}s"
+        return f"{response_time:.2f}s"
+
+def format_timestamp(timestamp_ms: int, fmt: str = "%Y-%m-%d %H:%M") -> str:
+    """Format an epoch-milliseconds timestamp for display in local time."""
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime(fmt)
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting it on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="async-io", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+def run_async(coro: Awaitable[Any]) -> Any:
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+    
+    A single long-lived loop keeps async HTTP clients and their connection
+    pools usable across Streamlit reruns, which each happen on a new thread.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+async def _anext(agen: AsyncIterator[Any]) -> Any:
+    return await agen.__anext__()
+
+def iterate_async(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Consume an async generator from synchronous code, e.g. for st.write_stream.
+    
+    Close the returned iterator (or exhaust it) on the calling script thread;
+    that closes agen on the shared loop and releases whatever it holds open.
+    """
+    try:
+        while True:
+            try:
+                yield run_async(_anext(agen))
+            except StopAsyncIteration:
+                return
+    finally:
+        if threading.current_thread() is _loop_thread:
+            # Finalized on the loop thread itself (e.g. by the GC): waiting here
+            # would block the loop on its own task, so just schedule the close
+            _loop.create_task(agen.aclose())
+        else:
+            run_async(agen.aclose())
@@ -1,8 +1,12 @@
-﻿import openai
-from typing import Dict, Any, Optional
+﻿from typing import Dict, Any, Optional, AsyncIterator, Iterator, List, Mapping, Tuple, Callable, Union
+from types import MappingProxyType
+from functools import cached_property, lru_cache
 import logging
 import time
+import random
+import asyncio
 from config import Config
+from utils.helpers import iterate_async
 
 class LLMService:
     """Enhanced service class for handling multiple LLM models."""
@@ -13,9 +17,11 @@ class LLMService:
             missing = Config.get_missing_config()
             raise ValueError(f"Missing required configuration: {', '.join(missing)}")
         
-        self.client = openai.OpenAI(api_key=Config.OPENAI_API_KEY)
         self.logger = logging.getLogger(__name__)
         
+        # Caps in-flight async requests to stay within the account's rate limits
+        self._sem = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
+        
         # Available models with their configurations
         self.models = {
             "gpt-3.5-turbo": {
@@ -40,24 +46,167 @@ class LLMService:
                 "supports_functions": True
             }
         }
+        self._models_view = MappingProxyType(self.models)
+        
+        # Tokenizers are built on first use and reused for every estimate
+        self._encoders: Dict[str, Optional[Any]] = {}
+        
+        # Request builders specialized per (model, system prompt)
+        self._get_sender = lru_cache(maxsize=32)(self._make_sender)
+    
+    def _http_client_options(self) -> Dict[str, Any]:
+        """Connection pool settings shared by the sync and async HTTP clients."""
+        import httpx
+        return {
+            "http2": True,  # multiplex concurrent requests over one connection
+            "limits": httpx.Limits(
+                max_connections=Config.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            "timeout": Config.API_TIMEOUT
+        }
+    
+    # openai and tiktoken are imported on first use: both are slow to import
+    # and a session that only browses history never needs them. The SDK's own
+    # retries are disabled so _describe_error/_retry_delay are the only policy.
+    @cached_property
+    def client(self):
+        """Synchronous OpenAI client, created on first use."""
+        import openai
+        return openai.OpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            max_retries=0,
+            http_client=openai.DefaultHttpxClient(**self._http_client_options())
+        )
+    
+    @cached_property
+    def aclient(self):
+        """Async OpenAI client, created on first use and bound to the shared event loop."""
+        import openai
+        return openai.AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(**self._http_client_options())
+        )
     
-    def get_available_models(self) -> Dict[str, Dict]:
-        """Return available models and their configurations."""
-        return self.models
+    def get_available_models(self) -> Mapping[str, Dict]:
+        """Return a read-only view of the available models and their configurations."""
+        return self._models_view
     
-    def estimate_cost(self, message: str, model: str = "gpt-3.5-turbo") -> float:
-        """Estimate the cost of a message for a given model."""
+    def _encoder(self, model: str):
+        """Return the cached tokenizer for a model, or None if it can't be loaded."""
+        if model not in self._encoders:
+            try:
+                import tiktoken
+                try:
+                    encoder = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # tiktoken downloads its BPE files on first use; remember the
+                # failure so an offline host doesn't retry on every message
+                self.logger.warning(f"Tokenizer unavailable for {model}, estimating tokens: {e}")
+                encoder = None
+            self._encoders[model] = encoder
+        return self._encoders[model]
+    
+    def count_tokens(self, message: str, model: str = "gpt-3.5-turbo") -> Optional[int]:
+        """Count the prompt tokens a message will use, or None if no tokenizer is available."""
+        if model not in self.models:
+            return None
+        encoder = self._encoder(model)
+        if encoder is None:
+            return None
+        return len(encoder.encode(message))
+    
+    def estimate_cost(self, message: str, model: str = "gpt-3.5-turbo",
+                      prompt_tokens: Optional[int] = None) -> float:
+        """
+        Estimate the cost of a message for a given model.
+        
+        Pass prompt_tokens when the count is already known (from count_tokens
+        or the API's usage report) to avoid tokenizing the message again.
+        """
         if model not in self.models:
             return 0.0
         
-        # Rough token estimation (1 token  4 characters)
-        estimated_tokens = len(message) / 4
+        if prompt_tokens is None:
+            prompt_tokens = self.count_tokens(message, model)
+        if prompt_tokens is None:
+            prompt_tokens = len(message) / 4  # Rough estimate: 1 token per 4 characters
         cost_per_1k = self.models[model]["cost_per_1k"]
-        return (estimated_tokens / 1000) * cost_per_1k
+        return (prompt_tokens / 1000) * cost_per_1k
+    
+    def _validate_message(self, message: str) -> Optional[str]:
+        """Return an error description if the message can't be sent, else None."""
+        # O(1) checks first; only strip (which copies) once the length is known to be fine
+        if not message:
+            return "Empty message provided"
+        if len(message) > Config.MAX_MESSAGE_LENGTH:
+            return f"Message too long. Maximum {Config.MAX_MESSAGE_LENGTH} characters allowed."
+        if not message.strip():
+            return "Empty message provided"
+        return None
+    
+    def _make_sender(self, model: str, system_prompt: str = None) -> Callable[[str, float, int], Dict[str, Any]]:
+        """
+        Build a request builder specialized for one model and system prompt.
+        
+        Model validation, the max_tokens cap and the system message are
+        resolved once here rather than on every send.
+        
+        Returns:
+            Callable taking (message, temperature, max_tokens) and returning
+            the keyword arguments for chat.completions.create
+        """
+        if model not in self.models:
+            model = "gpt-3.5-turbo"  # Fallback to default
+        token_cap = self.models[model]["max_tokens"]
+        head = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        timeout = Config.API_TIMEOUT
+        
+        def build_request(message: str, temperature: float, max_tokens: int) -> Dict[str, Any]:
+            return {
+                "model": model,
+                "messages": head + [{"role": "user", "content": message}],
+                "max_tokens": min(max_tokens, token_cap),
+                "temperature": max(0.0, min(2.0, temperature)),  # Clamp temperature
+                "timeout": timeout
+            }
+        
+        return build_request
+    
+    def _describe_error(self, error: Exception) -> Tuple[str, bool]:
+        """Return a user-facing message for an API error and whether a retry may succeed."""
+        import openai
+        
+        # Most specific first: every openai error below subclasses APIError
+        if isinstance(error, openai.AuthenticationError):
+            return "Invalid API key. Please check your configuration.", False
+        if isinstance(error, openai.RateLimitError):
+            return "Rate limit exceeded. Please try again later.", True
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+            return f"API Error: {str(error)}", True
+        if isinstance(error, openai.APIError):
+            return f"API Error: {str(error)}", False
+        return f"Unexpected error: {str(error)}", False
+    
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before the next attempt: exponential backoff with jitter."""
+        import openai
+        
+        if isinstance(error, openai.RateLimitError):
+            retry_after = error.response.headers.get("retry-after")
+            try:
+                return min(30.0, float(retry_after))
+            except (TypeError, ValueError):
+                pass
+        return min(30, 2 ** attempt) + random.uniform(0, 0.5)
     
     def send_message(self, message: str, model: str = "gpt-3.5-turbo", 
                     temperature: float = 0.7, max_tokens: int = 1000,
-                    system_prompt: str = None) -> Dict[str, Any]:
+                    system_prompt: str = None, stream: bool = False,
+                    result: Optional[Dict[str, Any]] = None) -> Union[Dict[str, Any], Iterator[str]]:
         """
         Send a message to the LLM and return the response.
         
@@ -67,47 +216,39 @@ class LLMService:
             temperature (float): Response creativity (0.0-2.0)
             max_tokens (int): Maximum response length
             system_prompt (str): Optional system prompt for behavior
+            stream (bool): Return a generator of content tokens instead of
+                waiting for the full response; it drives asend_message on
+                the shared event loop
+            result (dict): With stream=True, optional dict that is filled
+                with the usual result keys once the stream has finished
             
         Returns:
-            Dict containing 'success', 'response', 'error', 'response_time'
+            Dict containing 'success', 'response', 'error', 'response_time',
+            or an iterator of response chunks when stream=True
         """
-        if not message or not message.strip():
-            return {
-                "success": False,
-                "response": None,
-                "error": "Empty message provided",
-                "response_time": 0
-            }
+        if stream:
+            return iterate_async(self.asend_message(
+                message, model=model, temperature=temperature, max_tokens=max_tokens,
+                system_prompt=system_prompt, result=result
+            ))
         
-        if len(message) > Config.MAX_MESSAGE_LENGTH:
+        error = self._validate_message(message)
+        if error:
             return {
                 "success": False,
                 "response": None,
-                "error": f"Message too long. Maximum {Config.MAX_MESSAGE_LENGTH} characters allowed.",
+                "error": error,
                 "response_time": 0
             }
         
-        # Validate model
-        if model not in self.models:
-            model = "gpt-3.5-turbo"  # Fallback to default
-        
-        # Prepare messages
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": message})
+        request = self._get_sender(model, system_prompt)(message, temperature, max_tokens)
+        model = request["model"]
         
         start_time = time.time()
         
         for attempt in range(Config.MAX_RETRIES):
             try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    max_tokens=min(max_tokens, self.models[model]["max_tokens"]),
-                    temperature=max(0.0, min(2.0, temperature)),  # Clamp temperature
-                    timeout=Config.API_TIMEOUT
-                )
+                response = self.client.chat.completions.create(**request)
                 
                 response_time = time.time() - start_time
                 
@@ -119,7 +260,10 @@ class LLMService:
                         "response_time": response_time,
                         "model_used": model,
                         "tokens_used": response.usage.total_tokens if response.usage else None,
-                        "estimated_cost": self.estimate_cost(message, model)
+                        "estimated_cost": self.estimate_cost(
+                            message, model,
+                            prompt_tokens=response.usage.prompt_tokens if response.usage else None
+                        )
                     }
                 else:
                     return {
@@ -129,47 +273,217 @@ class LLMService:
                         "response_time": response_time
                     }
                     
-            except openai.APIError as e:
-                self.logger.error(f"OpenAI API error (attempt {attempt + 1}): {e}")
-                if attempt == Config.MAX_RETRIES - 1:
+            except Exception as e:
+                error, retryable = self._describe_error(e)
+                self.logger.error(f"OpenAI request failed (attempt {attempt + 1}): {e}")
+                if not retryable or attempt == Config.MAX_RETRIES - 1:
                     return {
                         "success": False,
                         "response": None,
-                        "error": f"API Error: {str(e)}",
+                        "error": error,
                         "response_time": time.time() - start_time
                     }
-                time.sleep(1)
+                time.sleep(self._retry_delay(attempt, e))
+    
+    async def asend_message(self, message: str, model: str = "gpt-3.5-turbo",
+                            temperature: float = 0.7, max_tokens: int = 1000,
+                            system_prompt: str = None,
+                            result: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Stream a response from the LLM, yielding content tokens as they arrive.
+        
+        Args:
+            message (str): The user's message
+            model (str): The OpenAI model to use
+            temperature (float): Response creativity (0.0-2.0)
+            max_tokens (int): Maximum response length
+            system_prompt (str): Optional system prompt for behavior
+            result (dict): Optional dict that is filled with the same keys
+                send_message returns once the stream has finished
+            
+        Yields:
+            str: Response content chunks
+        """
+        if result is None:
+            result = {}
+        
+        error = self._validate_message(message)
+        if error:
+            result.update({
+                "success": False,
+                "response": None,
+                "error": error,
+                "response_time": 0
+            })
+            return
+        
+        request = self._get_sender(model, system_prompt)(message, temperature, max_tokens)
+        model = request["model"]
+        
+        start_time = time.time()
+        stream = None
+        
+        for attempt in range(Config.MAX_RETRIES):
+            try:
+                # Only opening the stream counts against the cap, not reading it
+                async with self._sem:
+                    stream = await self.aclient.chat.completions.create(
+                        **request,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                break
                 
-            except openai.RateLimitError as e:
-                self.logger.error(f"Rate limit exceeded (attempt {attempt + 1}): {e}")
-                if attempt == Config.MAX_RETRIES - 1:
+            except Exception as e:
+                error, retryable = self._describe_error(e)
+                self.logger.error(f"OpenAI request failed (attempt {attempt + 1}): {e}")
+                if not retryable or attempt == Config.MAX_RETRIES - 1:
+                    break
+                await asyncio.sleep(self._retry_delay(attempt, e))
+        
+        if stream is None:
+            result.update({
+                "success": False,
+                "response": None,
+                "error": error,
+                "response_time": time.time() - start_time
+            })
+            return
+        
+        chunks = []
+        tokens_used = None
+        prompt_tokens = None
+        try:
+            async for chunk in stream:
+                # The final chunk carries usage and no choices
+                if chunk.usage:
+                    tokens_used = chunk.usage.total_tokens
+                    prompt_tokens = chunk.usage.prompt_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    content = chunk.choices[0].delta.content
+                    chunks.append(content)
+                    yield content
+        except Exception as e:
+            self.logger.error(f"Error while streaming response: {e}")
+            result.update({
+                "success": False,
+                "response": "".join(chunks) or None,
+                "error": f"Stream interrupted: {str(e)}",
+                "response_time": time.time() - start_time
+            })
+            return
+        finally:
+            # Release the pooled connection even when the consumer stops early
+            await stream.close()
+        
+        if not chunks:
+            result.update({
+                "success": False,
+                "response": None,
+                "error": "Empty response from API",
+                "response_time": time.time() - start_time
+            })
+            return
+        
+        result.update({
+            "success": True,
+            "response": "".join(chunks),
+            "error": None,
+            "response_time": time.time() - start_time,
+            "model_used": model,
+            "tokens_used": tokens_used,
+            "estimated_cost": self.estimate_cost(message, model, prompt_tokens=prompt_tokens)
+        })
+    
+    async def _asend_one(self, message: str, model: str, temperature: float,
+                         max_tokens: int, system_prompt: str = None) -> Dict[str, Any]:
+        """Send a single non-streaming request on the async client."""
+        request = self._get_sender(model, system_prompt)(message, temperature, max_tokens)
+        start_time = time.time()
+        
+        for attempt in range(Config.MAX_RETRIES):
+            try:
+                async with self._sem:
+                    response = await self.aclient.chat.completions.create(**request)
+                break
+            except Exception as e:
+                error, retryable = self._describe_error(e)
+                self.logger.error(f"OpenAI request for {model} failed (attempt {attempt + 1}): {e}")
+                if not retryable or attempt == Config.MAX_RETRIES - 1:
                     return {
                         "success": False,
                         "response": None,
-                        "error": "Rate limit exceeded. Please try again later.",
+                        "error": error,
                         "response_time": time.time() - start_time
                     }
-                time.sleep(2)
-                
-            except openai.AuthenticationError as e:
-                return {
+                # Back off outside the semaphore so other models can proceed
+                await asyncio.sleep(self._retry_delay(attempt, e))
+        
+        response_time = time.time() - start_time
+        
+        if response.choices and response.choices[0].message:
+            return {
+                "success": True,
+                "response": response.choices[0].message.content,
+                "error": None,
+                "response_time": response_time,
+                "model_used": model,
+                "tokens_used": response.usage.total_tokens if response.usage else None,
+                "estimated_cost": self.estimate_cost(
+                    message, model,
+                    prompt_tokens=response.usage.prompt_tokens if response.usage else None
+                )
+            }
+        return {
+            "success": False,
+            "response": None,
+            "error": "Empty response from API",
+            "response_time": response_time
+        }
+    
+    async def asend_message_multi(self, message: str, models: List[str],
+                                  temperature: float = 0.7, max_tokens: int = 1000,
+                                  system_prompt: str = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Send the same message to several models concurrently.
+        
+        Args:
+            message (str): The user's message
+            models (list): The OpenAI models to query
+            temperature (float): Response creativity (0.0-2.0)
+            max_tokens (int): Maximum response length
+            system_prompt (str): Optional system prompt for behavior
+            
+        Returns:
+            Dict mapping each model to a send_message-style result dict
+        """
+        error = self._validate_message(message)
+        models = [model for model in models if model in self.models]
+        if error:
+            return {
+                model: {"success": False, "response": None, "error": error, "response_time": 0}
+                for model in models
+            }
+        
+        results = await asyncio.gather(
+            *[self._asend_one(message, model, temperature, max_tokens, system_prompt)
+              for model in models],
+            return_exceptions=True
+        )
+        
+        combined = {}
+        for model, result in zip(models, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"Unexpected error for {model}: {result}")
+                result = {
                     "success": False,
                     "response": None,
-                    "error": "Invalid API key. Please check your configuration.",
-                    "response_time": time.time() - start_time
+                    "error": f"Unexpected error: {str(result)}",
+                    "response_time": 0
                 }
-                
-            except Exception as e:
-                self.logger.error(f"Unexpected error (attempt {attempt + 1}): {e}")
-                if attempt == Config.MAX_RETRIES - 1:
-                    return {
-                        "success": False,
-                        "response": None,
-                        "error": f"Unexpected error: {str(e)}",
-                        "response_time": time.time() - start_time
-                    }
-                time.sleep(1)
+            combined[model] = result
+        return combined
     
     def test_connection(self, model: str = "gpt-3.5-turbo") -> Dict[str, Any]:
         """Test the API connection with a simple message."""
-        return self.send_message("Hello! This is a connection test.", model=model)
+        return self.send_message("Hello! This is a connection test.", model=model)
@@ -39,6 +39,14 @@ def render_model_selector(llm_service: LLMService):
  Cost:  per 1K tokens
  Max tokens: {model_info['max_tokens']:,}""")
         
+        # Side-by-side comparison
+        compare_models = st.multiselect(
+            "Compare models",
+            model_options,
+            format_func=lambda key: models[key]["name"],
+            help="Pick two or more models to send each message to all of them at once and show the answers side by side"
+        )
+        
         # Advanced settings
         with st.expander(" Advanced Settings", expanded=False):
             # Temperature slider
@@ -74,5 +82,6 @@ def render_model_selector(llm_service: LLMService):
         st.session_state.temperature = temperature
         st.session_state.max_tokens = max_tokens
         st.session_state.system_prompt = system_prompt if system_prompt.strip() else None
+        st.session_state.compare_models = compare_models
         
-        return selected_model, temperature, max_tokens, system_prompt if system_prompt.strip() else None
+        return selected_model, temperature, max_tokens, system_prompt if system_prompt.strip() else None, compare_models
@@ -1,6 +1,12 @@
 ﻿import streamlit as st
 from pathlib import Path
 
+@st.cache_data(show_spinner=False)
+def _read_css(css_path: str, mtime_ns: int) -> str:
+    """Read a theme stylesheet; cached until the file changes on disk."""
+    with open(css_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
 class ThemeService:
     """Simple service for managing dark/light themes."""
     
@@ -14,16 +20,18 @@ class ThemeService:
     def load_theme_css(self, theme_name: str) -> str:
         """Load CSS content for a theme."""
         css_file = self.themes_dir / f"{theme_name}.css"
-        if css_file.exists():
-            try:
-                with open(css_file, 'r', encoding='utf-8') as f:
-                    return f.read()
-            except Exception:
-                return ""
-        return ""
+        try:
+            return _read_css(str(css_file), css_file.stat().st_mtime_ns)
+        except Exception:
+            return ""
     
     def apply_theme(self, theme_name: str):
-        """Apply a theme to the Streamlit app."""
+        """
+        Apply a theme to the Streamlit app.
+        
+        The <style> block has to be emitted on every run: Streamlit drops any
+        element a rerun doesn't redraw, so skipping it would revert the theme.
+        """
         css_content = self.load_theme_css(theme_name)
         if css_content:
             st.markdown(f"<style>{css_content}</style>", unsafe_allow_html=True)
@@ -53,12 +61,10 @@ class ThemeService:
             
             selected_theme = theme_options[selected_index]
             
-            # Update session state if theme changed
-            if selected_theme != st.session_state.current_theme:
-                st.session_state.current_theme = selected_theme
-                st.rerun()
+            # Update session state if theme changed; it is applied below in this same run
+            st.session_state.current_theme = selected_theme
             
             # Apply the current theme
             self.apply_theme(st.session_state.current_theme)
             
-            return selected_theme
+            return selected_theme